@@ -25,15 +25,22 @@ Use Cases Demonstrated:
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import numpy as np
-from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from datetime import datetime, timedelta, timezone
 import json
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, Any, Optional, List
 
+# plotly.express is imported inside the functions that draw Plotly charts so
+# sections without them don't pay its import cost
+
 # Import Snowflake modules
 from snowflake.snowpark.context import get_active_session
 
@@ -48,6 +55,14 @@ st.set_page_config(
 # Get Snowflake session
 session = get_active_session()
 
+# Chart colors shared by every risk-level visualization
+RISK_COLORS = {
+    'CRITICAL': '#FF4B4B',
+    'HIGH': '#FF8C00',
+    'MEDIUM': '#FFD700',
+    'LOW': '#90EE90'
+}
+
 # =====================================================
 # CORTEX ANALYST CONFIGURATION
 # =====================================================
@@ -58,6 +73,16 @@ SCHEMA = "SECURITY_ANALYTICS"
 STAGE = "SEMANTIC_MODEL_STAGE"
 FILE = "cybersecurity_semantic_model.yaml"
 
+# Seconds to wait on the Cortex Analyst REST API before giving up
+ANALYST_API_TIMEOUT = 30
+
+@st.cache_resource
+def analyst_http_session() -> requests.Session:
+    """HTTP session shared across reruns so analyst calls reuse pooled TLS connections"""
+    http = requests.Session()
+    http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return http
+
 def send_cortex_analyst_message(prompt: str) -> Dict[str, Any]:
     """Calls the Cortex Analyst REST API and returns the response."""
     try:
@@ -71,13 +96,15 @@ def send_cortex_analyst_message(prompt: str) -> Dict[str, Any]:
             "semantic_model_file": f"@{DATABASE}.{SCHEMA}.{STAGE}/{FILE}",
         }
         
-        resp = requests.post(
+        resp = analyst_http_session().post(
             url=f"https://{host}/api/v2/cortex/analyst/message",
             json=request_body,
             headers={
                 "Authorization": f'Snowflake Token="{session.connection.rest.token}"',
                 "Content-Type": "application/json",
+                "Accept-Encoding": "gzip",
             },
+            timeout=ANALYST_API_TIMEOUT,
         )
         
         request_id = resp.headers.get("X-Snowflake-Request-Id")
@@ -100,8 +127,9 @@ def display_cortex_content(content: List[Dict[str, str]], request_id: Optional[s
             st.markdown(item["text"])
         elif item["type"] == "suggestions":
             with st.expander("💡 Suggested Questions", expanded=True):
-                for suggestion in item["suggestions"]:
-                    if st.button(f"➤ {suggestion}", key=f"suggestion_{hash(suggestion)}"):
+                # Keyed per message: the same suggestion can appear in several past answers
+                for index, suggestion in enumerate(item["suggestions"]):
+                    if st.button(f"➤ {suggestion}", key=f"suggestion_{request_id}_{index}"):
                         st.session_state.active_suggestion = suggestion
         elif item["type"] == "sql":
             with st.expander("📊 Generated SQL Query", expanded=False):
@@ -109,41 +137,199 @@ def display_cortex_content(content: List[Dict[str, str]], request_id: Optional[s
             
             with st.expander("📈 Query Results", expanded=True):
                 with st.spinner("Executing query..."):
+                    statement = item["statement"].strip().rstrip(';')
+                    truncated = False
                     try:
-                        # Execute the SQL using Snowflake session
-                        df = session.sql(item["statement"]).to_pandas()
+                        # Execute the SQL using Snowflake session, fetching one extra
+                        # row so we know whether the result was cut off
+                        df = statement_preview(statement)
+                        truncated = len(df.index) > MAX_RESULT_ROWS
+                        if truncated:
+                            df = df.head(MAX_RESULT_ROWS)
+                            st.warning(f"Showing the first {MAX_RESULT_ROWS:,} rows of a larger result.")
                         
-                        if len(df.index) > 1:
+                        schema = result_schema(df)
+                        if schema.rows > 1:
                             # Create tabs for different visualizations
                             data_tab, line_tab, bar_tab = st.tabs(["📋 Data", "📈 Line Chart", "📊 Bar Chart"])
                             
                             with data_tab:
-                                st.dataframe(df, use_container_width=True)
+                                st.dataframe(df, use_container_width=True, column_config=number_column_config(df))
                             
                             if len(df.columns) > 1:
                                 df_viz = df.set_index(df.columns[0])
                                 with line_tab:
-                                    st.line_chart(df_viz)
+                                    st.line_chart(thin_series(df.set_index(schema.date[0]) if schema.date else df_viz))
                                 with bar_tab:
-                                    st.bar_chart(df_viz)
+                                    st.bar_chart(limit_bars(top_categories(statement, df, df_viz, schema)))
                         else:
-                            st.dataframe(df, use_container_width=True)
+                            display_single_row_metrics(df, schema)
+                            st.dataframe(df, use_container_width=True, column_config=number_column_config(df))
                     except Exception as e:
                         st.error(f"Error executing query: {str(e)}")
+                
+                if truncated:
+                    # The same question asked twice renders the same statement twice
+                    offer_full_download(statement, f"{request_id}_{hash(statement) & 0xffffffff:x}")
+
+def offer_full_download(statement: str, key: str) -> None:
+    """Run the full statement for a CSV download only once the user asks for it"""
+    prepared = st.session_state.setdefault("prepared_downloads", set())
+    if key not in prepared:
+        st.button("📦 Prepare full CSV", key=f"prepare_{key}", on_click=prepared.add, args=(key,))
+        return
+    
+    try:
+        data = full_result_csv(statement)
+    except Exception as e:
+        st.error(f"Error exporting full results: {str(e)}")
+        return
+    st.download_button(
+        "📥 Download Full Results (CSV)",
+        data=data,
+        file_name="cortex_analyst_results.csv",
+        mime="text/csv",
+        key=f"download_{key}"
+    )
+
+def display_single_row_metrics(df: pd.DataFrame, schema: "ResultSchema") -> None:
+    """Show the numeric columns of a single-row result as metric cards"""
+    numeric_cols = schema.numeric
+    if not schema.rows or not numeric_cols:
+        return
+    
+    # Read the row once instead of indexing each column separately
+    row = df.iloc[0].to_dict()
+    for widget, name in zip(st.columns(len(numeric_cols)), numeric_cols):
+        value = row[name]
+        # Format by dtype so fractional measures such as an average CVSS keep their decimals
+        spec = ",.0f" if pd.api.types.is_integer_dtype(df[name]) else ",.2f"
+        with widget:
+            st.metric(name.replace('_', ' ').title(), f"{value:{spec}}")
 
 # =====================================================
 # UTILITY FUNCTIONS
 # =====================================================
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def run_query(query):
-    """Execute SQL query and return results as DataFrame"""
+# Interactive reads run here instead of the ML warehouse (created by sql/04_dashboard_aggregates.sql)
+APP_WAREHOUSE = "CYBERSECURITY_APP_WH"
+
+# Session parameters applied once per Streamlit session
+SESSION_PARAMETERS = [
+    "ALTER SESSION SET USE_CACHED_RESULT = TRUE",
+    "ALTER SESSION SET QUERY_TAG = 'cybersecurity_demo_streamlit'",
+    # Arrow result batches for the remaining to_pandas() fetches (chat SQL previews)
+    "ALTER SESSION SET PYTHON_CONNECTOR_QUERY_RESULT_FORMAT = 'ARROW'",
+]
+
+def configure_session():
+    """Tag app queries, enable the result cache and switch to the app warehouse"""
+    if st.session_state.get("session_configured"):
+        return
+    
+    for statement in SESSION_PARAMETERS:
+        try:
+            session.sql(statement).collect()
+        except Exception:
+            pass  # Tuning only; the app works with the account defaults
+    try:
+        session.sql(f"USE WAREHOUSE {APP_WAREHOUSE}").collect()
+    except Exception:
+        pass  # Keep the app's default warehouse until 04_dashboard_aggregates.sql has run
+    st.session_state.session_configured = True
+
+# Dashboard reads are small aggregates, so a runaway one is cut off; full CSV exports
+# and analyst calls keep the account's statement timeout
+DASHBOARD_STATEMENT_PARAMS = {"STATEMENT_TIMEOUT_IN_SECONDS": 60}
+
+def arrow_result(dataframe, **kwargs) -> pa.Table:
+    """Result of a Snowpark DataFrame as an Arrow table"""
+    # DataFrame.to_arrow is missing from older Snowpark releases still found in some
+    # Streamlit in Snowflake environments; go through pandas there
+    if hasattr(dataframe, "to_arrow"):
+        return dataframe.to_arrow(**kwargs)
+    return pa.Table.from_pandas(dataframe.to_pandas(**kwargs), preserve_index=False)
+
+@st.cache_resource(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def _run_query_arrow(cache_key: str, params: Optional[tuple], _query: str) -> pa.Table:
+    """Execute SQL query and return the result as an Arrow table, cached on cache_key"""
+    # The leading underscore keeps _query out of the cache hash
+    return arrow_result(session.sql(_query, params=list(params) if params else None),
+                        statement_params=DASHBOARD_STATEMENT_PARAMS)
+
+def fetch_arrow(query: str, params=None) -> pa.Table:
+    """Cached Arrow result of a query with optional ? bind parameters; raises on failure"""
+    # Reformatted copies of a query share one cache entry keyed on the whitespace-folded
+    # text, while Snowflake still receives the query as written, -- comments and all
+    return _run_query_arrow(" ".join(query.split()), tuple(params) if params else None, query)
+
+def run_query_arrow(query, params=None, quiet=False) -> pa.Table:
+    """Execute SQL query with optional ? bind parameters and return the shared Arrow table"""
     try:
-        result = session.sql(query).to_pandas()
-        return result
+        # Arrow tables are immutable, so one cached instance is shared without pickling
+        return fetch_arrow(query, params)
     except Exception as e:
-        st.error(f"Query execution error: {str(e)}")
-        return pd.DataFrame()
+        # quiet reads probe optional objects (rollups, ML tables) that callers fall back from
+        if not quiet:
+            st.error(f"Query execution error: {str(e)}")
+        return pa.table({})
+
+def run_query(query, params=None, quiet=False):
+    """Execute SQL query with optional ? bind parameters and return results as DataFrame"""
+    # Each caller gets its own pandas frame and may mutate it freely
+    return run_query_arrow(query, params, quiet).to_pandas(split_blocks=True)
+
+def window_start(days_back: int) -> str:
+    """Start of a days_back analysis window as a bindable UTC literal, floored to the hour"""
+    # A constant bound cutoff prunes partitions at compile time; CURRENT_TIMESTAMP() would not
+    start = datetime.now(timezone.utc) - timedelta(days=days_back)
+    return start.replace(minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S +00:00')
+
+def _fetch_or_error(query: tuple):
+    """Worker body for run_queries_parallel: the Arrow result, or the exception raised"""
+    try:
+        return fetch_arrow(*query)
+    except Exception as e:
+        return e
+
+def run_queries_parallel(queries: List[tuple], quiet=False) -> List[pd.DataFrame]:
+    """Run independent (query, params) pairs concurrently, returning results in order"""
+    # Workers only fetch and never call Streamlit; errors are reported here on the
+    # script thread, in submission order
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        results = list(pool.map(_fetch_or_error, queries))
+    
+    frames = []
+    for result in results:
+        if isinstance(result, Exception):
+            if not quiet:
+                st.error(f"Query execution error: {str(result)}")
+            frames.append(pd.DataFrame())
+        else:
+            frames.append(result.to_pandas(split_blocks=True))
+    return frames
+
+@st.cache_data(ttl=86400, show_spinner=False)  # Cache for a day
+def get_user_count() -> int:
+    """Distinct employees in the directory, which changes far slower than the event tables"""
+    return session.sql("SELECT COUNT(DISTINCT username) FROM EMPLOYEE_DATA").collect()[0][0]
+
+def count_query(table: str, predicate: str, date_column: str, window: str) -> tuple:
+    """(query, params) counting rows of table that match predicate since window"""
+    # One canonical text per count, so tiles asking the same question share a cache entry
+    return (f"SELECT COUNT(*) as count FROM {table} WHERE {predicate} AND {date_column} >= ?::TIMESTAMP_LTZ",
+            [window])
+
+def count_value(result: pd.DataFrame) -> Optional[int]:
+    """Scalar of a count_query result; None if the query failed (e.g. the table doesn't exist yet)"""
+    return int(result['COUNT'].iloc[0]) if not result.empty else None
+
+def union_all(queries: Dict[str, tuple]) -> tuple:
+    """Combine same-shaped (query, params) pairs into one (query, params) tagged by a _Q label column"""
+    union = "\nUNION ALL\n".join(
+        f"SELECT '{label}' AS _q, * FROM ({query})" for label, (query, _) in queries.items()
+    )
+    return union, [value for _, params in queries.values() for value in (params or [])]
 
 def format_metric(value, metric_type="number"):
     """Format metrics for display"""
@@ -160,10 +346,151 @@ def format_metric(value, metric_type="number"):
             return f"{value:,.0f}"
     return str(value)
 
+def create_metric_cards(cards: List[tuple]) -> None:
+    """Render a row of (label, value) metric cards with a single markdown element"""
+    tiles = "".join(
+        '<div style="flex:1;padding:1rem;border:1px solid rgba(128,128,128,0.3);border-radius:0.5rem">'
+        f'<div style="font-size:0.875rem;opacity:0.7">{label}</div>'
+        f'<div style="font-size:1.75rem;font-weight:600">{value}</div>'
+        '</div>'
+        for label, value in cards
+    )
+    st.markdown(f'<div style="display:flex;gap:1rem">{tiles}</div>', unsafe_allow_html=True)
+
+def records_to_frame(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Build a DataFrame from row records with a single columnar pass"""
+    if not records:
+        return pd.DataFrame()
+    
+    # Records may be ragged (OBJECT_CONSTRUCT drops NULL-valued keys), so take the
+    # union of keys in first-seen order and fill the gaps with None
+    keys = list(dict.fromkeys(key for row in records for key in row))
+    return pd.DataFrame.from_dict({key: [row.get(key) for row in records] for key in keys})
+
+def shrink_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast numeric columns and categorize repetitive strings to cut memory traffic"""
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            # Only narrow floats that survive the float32 round trip unchanged
+            narrowed = series.astype('float32')
+            if narrowed.astype('float64').equals(series):
+                df[col] = narrowed
+        elif (pd.api.types.infer_dtype(series, skipna=True) == 'string'
+                and series.nunique() < 0.5 * len(series)):
+            df[col] = series.astype('category')
+    return df
+
+_DATE_RE = re.compile(r'date|time', re.I)
+
+def date_columns(df: pd.DataFrame) -> List[str]:
+    """Datetime-typed columns first, then non-numeric columns whose name looks like a date"""
+    typed = df.select_dtypes(include=['datetime', 'datetimetz']).columns.tolist()
+    # Numeric measures such as RESPONSE_TIME_MINUTES match the name pattern but aren't axes
+    candidates = df.select_dtypes(exclude='number').columns
+    named = candidates[candidates.str.contains(_DATE_RE)].tolist()
+    return list(dict.fromkeys(typed + named))
+
+@dataclass
+class ResultSchema:
+    """Column roles of a result frame, computed once and used for chart dispatch"""
+    numeric: List[str]
+    categorical: List[str]
+    date: List[str]
+    rows: int
+
+def result_schema(df: pd.DataFrame) -> ResultSchema:
+    """Summarize a result frame's columns in a single pass over its dtypes"""
+    return ResultSchema(
+        numeric=df.select_dtypes('number').columns.tolist(),
+        categorical=df.select_dtypes(['object', 'category']).columns.tolist(),
+        date=date_columns(df),
+        rows=len(df.index)
+    )
+
+_CURRENCY_RE = re.compile(r'amount|cost|revenue', re.I)
+
+def number_column_config(df: pd.DataFrame) -> Dict[str, Any]:
+    """Format float columns in the frontend instead of through the pandas Styler"""
+    return {
+        col: st.column_config.NumberColumn(format="$%.2f" if _CURRENCY_RE.search(col) else "%.2f")
+        for col in df.select_dtypes('float').columns
+    }
+
+# Upper bound on rows sent to the browser for a single result table
+MAX_RESULT_ROWS = 5000
+
+@st.cache_data(ttl=300, show_spinner=False)
+def statement_preview(statement: str) -> pd.DataFrame:
+    """First MAX_RESULT_ROWS + 1 rows of a generated statement; the extra row flags truncation"""
+    # Chat history re-renders every answer on each rerun, so past results come from here
+    return shrink_dtypes(session.sql(statement).limit(MAX_RESULT_ROWS + 1).to_pandas())
+
+# Full exports can be large, so only the most recently prepared few are kept
+@st.cache_data(ttl=300, max_entries=4, show_spinner=False)
+def full_result_csv(statement: str) -> bytes:
+    """Materialize the complete result of a statement as CSV for download"""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(arrow_result(session.sql(statement)), sink)
+    return sink.getvalue().to_pybytes()
+
+MAX_BAR_CATEGORIES = 50
+
+MAX_LINE_POINTS = 1000
+
+def thin_series(chart_df: pd.DataFrame) -> pd.DataFrame:
+    """Keep at most MAX_LINE_POINTS evenly spaced rows for a line chart"""
+    step = -(-len(chart_df.index) // MAX_LINE_POINTS)
+    return chart_df.iloc[::step] if step > 1 else chart_df
+
+def limit_bars(chart_df: pd.DataFrame) -> pd.DataFrame:
+    """Keep only the largest MAX_BAR_CATEGORIES bars of a bar chart"""
+    numeric_cols = chart_df.select_dtypes('number').columns
+    if len(chart_df.index) <= MAX_BAR_CATEGORIES or numeric_cols.empty:
+        return chart_df
+    return chart_df.nlargest(MAX_BAR_CATEGORIES, numeric_cols[0])
+
+def top_categories(statement: str, df: pd.DataFrame, df_viz: pd.DataFrame,
+                   schema: ResultSchema) -> pd.DataFrame:
+    """Aggregate a large categorical result in Snowflake rather than charting every row"""
+    category, value = df.columns[0], df.columns[1]
+    if (schema.rows <= MAX_BAR_CATEGORIES
+            or category not in schema.categorical
+            or value not in schema.numeric):
+        return df_viz
+    
+    statement = statement.strip().rstrip(';')
+    # Generated SQL may end in a -- comment, so the closing paren goes on its own line
+    top = run_query(f"""
+        SELECT "{category}", SUM("{value}") AS "{value}"
+        FROM (
+{statement}
+        )
+        GROUP BY 1
+        ORDER BY 2 DESC
+        LIMIT {MAX_BAR_CATEGORIES}
+    """)
+    return top.set_index(category) if not top.empty else df_viz
+
 # =====================================================
 # CORTEX ANALYST FUNCTIONS
 # =====================================================
 
+# Constant statement text with a bound argument so Snowflake can reuse the compiled plan
+ANALYST_QUERY_SQL = "SELECT ask_security_analyst(?) as analyst_response"
+
+@lru_cache(maxsize=128)  # Bounded so long-lived sessions don't grow without limit
+def _parse_analyst_json(raw: str) -> Dict[str, Any]:
+    """Parse a raw analyst response; identical payloads are only parsed once"""
+    return json.loads(raw)
+
+def parse_analyst_response(raw: Any) -> Dict[str, Any]:
+    """Decode a VARIANT analyst response, which may already be deserialized"""
+    return _parse_analyst_json(raw) if isinstance(raw, str) else raw
+
+@st.cache_data(ttl=300, show_spinner=False)
 def query_cortex_analyst(question: str, context: str = "general") -> Dict[str, Any]:
     """
     Query Cortex Analyst with natural language and return structured results
@@ -175,106 +502,117 @@ def query_cortex_analyst(question: str, context: str = "general") -> Dict[str, A
     Returns:
         Dictionary with query results, SQL, and explanation
     """
-    try:
-        # Use the Cortex Analyst integration function if available
-        query = """
-        SELECT ask_security_analyst(%s) as analyst_response
-        """
-        
-        result = session.sql(query, [question]).collect()
-        
-        if result:
-            response = json.loads(result[0]['ANALYST_RESPONSE'])
-            return {
-                "success": True,
-                "data": response.get("data", []),
-                "sql": response.get("sql", ""),
-                "explanation": response.get("explanation", ""),
-                "visualization": response.get("visualization", {})
-            }
-        else:
-            return {"success": False, "error": "No response from Cortex Analyst"}
-            
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+    # Use the Cortex Analyst integration function if available. Errors propagate to
+    # the caller rather than being returned, so a transient failure isn't cached.
+    result = session.sql(ANALYST_QUERY_SQL, params=[question]).collect()
+    
+    if result:
+        response = parse_analyst_response(result[0]['ANALYST_RESPONSE'])
+        data = response.get("data", [])
+        return {
+            "success": True,
+            "data": shrink_dtypes(records_to_frame(data[:MAX_RESULT_ROWS])),
+            "truncated": len(data) > MAX_RESULT_ROWS,
+            "sql": response.get("sql", ""),
+            "explanation": response.get("explanation", ""),
+            "visualization": response.get("visualization", {})
+        }
+    else:
+        return {"success": False, "error": "No response from Cortex Analyst"}
+
+@dataclass(frozen=True)
+class FallbackAnalysis:
+    """Canned query and presentation used when Cortex Analyst is unavailable"""
+    query: str
+    days: int
+    display_sql: str
+    explanation: str
+    chart_type: str
+
+# Fallback analyses by intent; dict order is the precedence when a question matches several
+FALLBACK_ANALYSES = {
+    'incidents': FallbackAnalysis(
+        query="""
+            SELECT 
+                DATE(created_at) as date,
+                incident_type,
+                severity,
+                COUNT(*) as count
+            FROM SECURITY_INCIDENTS
+            WHERE created_at >= ?::TIMESTAMP_LTZ
+            GROUP BY DATE(created_at), incident_type, severity
+            ORDER BY date DESC
+        """,
+        days=30,
+        display_sql="SELECT DATE(created_at), incident_type, severity, COUNT(*) FROM SECURITY_INCIDENTS...",
+        explanation="Analysis of security incidents over the last 30 days, grouped by date, type, and severity.",
+        chart_type="bar",
+    ),
+    'users': FallbackAnalysis(
+        query="""
+            SELECT 
+                cluster_label,
+                COUNT(*) as user_count,
+                AVG(countries) as avg_countries
+            FROM SNOWPARK_ML_USER_CLUSTERS
+            WHERE analysis_date >= ?::TIMESTAMP_LTZ
+            GROUP BY cluster_label
+            ORDER BY user_count DESC
+        """,
+        days=7,
+        display_sql="SELECT cluster_label, COUNT(*), AVG(countries) FROM SNOWPARK_ML_USER_CLUSTERS...",
+        explanation="User behavior clustering analysis showing different user patterns and their geographic distribution.",
+        chart_type="pie",
+    ),
+    'threats': FallbackAnalysis(
+        query="""
+            SELECT 
+                threat_type,
+                severity,
+                COUNT(*) as threat_count,
+                AVG(confidence_score) as avg_confidence
+            FROM THREAT_INTEL_FEED
+            WHERE first_seen >= ?::TIMESTAMP_LTZ
+            GROUP BY threat_type, severity
+            ORDER BY threat_count DESC
+        """,
+        days=14,
+        display_sql="SELECT threat_type, severity, COUNT(*), AVG(confidence_score) FROM THREAT_INTEL_FEED...",
+        explanation="Threat intelligence analysis showing active threats by type and severity over the last 14 days.",
+        chart_type="heatmap",
+    ),
+}
+
+# Fallback intents and their trigger keywords, matched in a single pass over the question
+_FALLBACK_INTENT_RE = re.compile(
+    r"(?P<incidents>incident|alert|breach)"
+    r"|(?P<users>user|login|authentication)"
+    r"|(?P<threats>threat|malware|attack)"
+)
+
+def fallback_query(intent: str) -> tuple:
+    """(query, params) pair for a fallback analysis"""
+    analysis = FALLBACK_ANALYSES[intent]
+    return analysis.query, [window_start(analysis.days)]
+
+def fallback_response(intent: str, data: pd.DataFrame) -> Dict[str, Any]:
+    """Structured response for a fallback analysis result"""
+    analysis = FALLBACK_ANALYSES[intent]
+    return {
+        "success": True,
+        "data": shrink_dtypes(data),
+        "sql": analysis.display_sql,
+        "explanation": analysis.explanation,
+        "chart_type": analysis.chart_type
+    }
 
 def create_fallback_response(question: str) -> Dict[str, Any]:
     """Generate structured fallback responses when Cortex Analyst is not available"""
-    question_lower = question.lower()
+    intents = {match.lastgroup for match in _FALLBACK_INTENT_RE.finditer(question.lower())}
+    intent = next((name for name in FALLBACK_ANALYSES if name in intents), None)
     
-    if any(word in question_lower for word in ['incident', 'alert', 'breach']):
-        # Security incidents query
-        try:
-            data = run_query("""
-                SELECT 
-                    DATE(created_at) as date,
-                    incident_type,
-                    severity,
-                    COUNT(*) as count
-                FROM SECURITY_INCIDENTS
-                WHERE created_at >= DATEADD(day, -30, CURRENT_TIMESTAMP())
-                GROUP BY DATE(created_at), incident_type, severity
-                ORDER BY date DESC
-            """)
-            
-            return {
-                "success": True,
-                "data": data.to_dict('records') if not data.empty else [],
-                "sql": "SELECT DATE(created_at), incident_type, severity, COUNT(*) FROM SECURITY_INCIDENTS...",
-                "explanation": "Analysis of security incidents over the last 30 days, grouped by date, type, and severity.",
-                "chart_type": "bar"
-            }
-        except:
-            pass
-    
-    elif any(word in question_lower for word in ['user', 'login', 'authentication']):
-        # User analytics query
-        try:
-            data = run_query("""
-                SELECT 
-                    cluster_label,
-                    COUNT(*) as user_count,
-                    AVG(countries) as avg_countries
-                FROM SNOWPARK_ML_USER_CLUSTERS
-                WHERE analysis_date >= DATEADD(day, -7, CURRENT_TIMESTAMP())
-                GROUP BY cluster_label
-                ORDER BY user_count DESC
-            """)
-            
-            return {
-                "success": True,
-                "data": data.to_dict('records') if not data.empty else [],
-                "sql": "SELECT cluster_label, COUNT(*), AVG(countries) FROM SNOWPARK_ML_USER_CLUSTERS...",
-                "explanation": "User behavior clustering analysis showing different user patterns and their geographic distribution.",
-                "chart_type": "pie"
-            }
-        except:
-            pass
-    
-    elif any(word in question_lower for word in ['threat', 'malware', 'attack']):
-        # Threat intelligence query
-        try:
-            data = run_query("""
-                SELECT 
-                    threat_type,
-                    severity,
-                    COUNT(*) as threat_count,
-                    AVG(confidence_score) as avg_confidence
-                FROM THREAT_INTEL_FEED
-                WHERE first_seen >= DATEADD(day, -14, CURRENT_TIMESTAMP())
-                GROUP BY threat_type, severity
-                ORDER BY threat_count DESC
-            """)
-            
-            return {
-                "success": True,
-                "data": data.to_dict('records') if not data.empty else [],
-                "sql": "SELECT threat_type, severity, COUNT(*), AVG(confidence_score) FROM THREAT_INTEL_FEED...",
-                "explanation": "Threat intelligence analysis showing active threats by type and severity over the last 14 days.",
-                "chart_type": "heatmap"
-            }
-        except:
-            pass
+    if intent:
+        return fallback_response(intent, run_query(*fallback_query(intent)))
     
     # Default response
     return {
@@ -282,30 +620,54 @@ def create_fallback_response(question: str) -> Dict[str, Any]:
         "error": "Cortex Analyst not available. Try questions about: incidents, users, threats, or authentication patterns."
     }
 
-def visualize_data(data: list, chart_type: str = "bar", explanation: str = ""):
+# Plotly figures are shared across sessions and reruns; they are only rebuilt when the data changes
+@st.cache_resource(max_entries=64, show_spinner=False)
+def pie_figure(df: pd.DataFrame, values: str, names: str, title: Optional[str] = None):
+    """Plotly pie chart of values by names"""
+    import plotly.express as px
+    # Plotly would ship every row to the browser and sum there; send one row per slice
+    slices = df.groupby(names, observed=True, sort=False, dropna=False, as_index=False)[values].sum()
+    return px.pie(slices, values=values, names=names, title=title)
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def heatmap_figure(df: pd.DataFrame, x: str, y: str, z: str, title: Optional[str] = None):
+    """Plotly heatmap of z summed over x and y"""
+    import plotly.express as px
+    # A dense y-by-x matrix ships as one 2-D array instead of an (x, y, z) triple per row
+    matrix = df.pivot_table(index=y, columns=x, values=z, aggfunc='sum', fill_value=0, observed=True)
+    return px.imshow(matrix, text_auto=True, aspect='auto', labels=dict(color=z), title=title)
+
+def _bar_chart(df: pd.DataFrame) -> None:
+    st.bar_chart(limit_bars(df.set_index(df.columns[0])))
+
+def _line_chart(df: pd.DataFrame) -> None:
+    st.line_chart(thin_series(df.set_index(df.columns[0])))
+
+def _pie_chart(df: pd.DataFrame) -> None:
+    st.plotly_chart(pie_figure(df, df.columns[1], df.columns[0]), use_container_width=True)
+
+def _heatmap_chart(df: pd.DataFrame) -> None:
+    st.plotly_chart(heatmap_figure(df, df.columns[0], df.columns[1], df.columns[2]), use_container_width=True)
+
+# chart_type -> (minimum number of columns, renderer)
+CHART_RENDERERS = {
+    "bar": (2, _bar_chart),
+    "line": (2, _line_chart),
+    "pie": (2, _pie_chart),
+    "heatmap": (3, _heatmap_chart),
+}
+
+def visualize_data(df: pd.DataFrame, chart_type: str = "bar", explanation: str = ""):
     """Create visualizations based on the data and chart type"""
-    if not data:
+    if df.empty:
         st.warning("No data to visualize")
         return
     
-    df = pd.DataFrame(data)
-    
-    if chart_type == "bar" and len(df.columns) >= 2:
-        st.bar_chart(df.set_index(df.columns[0]))
-    
-    elif chart_type == "line" and len(df.columns) >= 2:
-        st.line_chart(df.set_index(df.columns[0]))
-    
-    elif chart_type == "pie" and len(df.columns) >= 2:
-        fig = px.pie(df, values=df.columns[1], names=df.columns[0])
-        st.plotly_chart(fig, use_container_width=True)
-    
-    elif chart_type == "heatmap" and len(df.columns) >= 3:
-        fig = px.density_heatmap(df, x=df.columns[0], y=df.columns[1], z=df.columns[2])
-        st.plotly_chart(fig, use_container_width=True)
-    
+    min_columns, render = CHART_RENDERERS.get(chart_type, (0, None))
+    if render and len(df.columns) >= min_columns:
+        render(df)
     else:
-        st.dataframe(df, use_container_width=True)
+        st.dataframe(df, use_container_width=True, column_config=number_column_config(df))
 
 # =====================================================
 # MAIN APPLICATION SECTIONS
@@ -315,197 +677,216 @@ def show_executive_dashboard(days_back):
     """Executive-level security metrics and KPIs"""
     st.header("🏢 Executive Security Dashboard")
     st.markdown("*High-level security posture and business impact metrics*")
+    window = window_start(days_back)
     
-    # Key metrics
-    col1, col2, col3, col4 = st.columns(4)
+    # The core counts share one round trip; ML_MODEL_COMPARISON stays separate so a
+    # missing ML table can't fail them. All three requests run concurrently.
+    # Incident and threat totals sum the whole days after the window start from the
+    # daily rollups (sql/04_dashboard_aggregates.sql) and count only the partial first
+    # day from the raw tables. The rollups and the ML table are both optional, so these
+    # reads are quiet and each has a fallback below.
+    core_counts, ml_anomalies, risk_trends = run_queries_parallel([
+        union_all({
+            'incidents': ("""
+                SELECT 
+                    (SELECT COALESCE(SUM(incidents), 0) 
+                     FROM MV_INCIDENTS_DAILY_BY_SEVERITY 
+                     WHERE date > DATE(?::TIMESTAMP_LTZ))
+                  + (SELECT COUNT(*) 
+                     FROM SECURITY_INCIDENTS 
+                     WHERE created_at >= ?::TIMESTAMP_LTZ 
+                     AND created_at < DATEADD(day, 1, DATE(?::TIMESTAMP_LTZ))) as count
+            """, [window] * 3),
+            'threats': ("""
+                SELECT 
+                    (SELECT COALESCE(SUM(threats), 0) 
+                     FROM MV_THREATS_DAILY_BY_SEVERITY 
+                     WHERE severity = 'critical' 
+                     AND date > DATE(?::TIMESTAMP_LTZ))
+                  + (SELECT COUNT(*) 
+                     FROM THREAT_INTEL_FEED 
+                     WHERE severity = 'critical' 
+                     AND first_seen >= ?::TIMESTAMP_LTZ 
+                     AND first_seen < DATEADD(day, 1, DATE(?::TIMESTAMP_LTZ))) as count
+            """, [window] * 3),
+        }),
+        count_query('ML_MODEL_COMPARISON', "risk_level IN ('CRITICAL', 'HIGH')", 'analysis_date', window),
+        ("""
+            SELECT 
+                DATE(analysis_date) as date,
+                risk_level,
+                COUNT(*) as incidents
+            FROM ML_MODEL_COMPARISON
+            WHERE analysis_date >= ?::TIMESTAMP_LTZ
+            GROUP BY DATE(analysis_date), risk_level
+            ORDER BY date
+        """, [window]),
+    ], quiet=True)
     
-    with col1:
-        total_incidents = run_query(f"""
-            SELECT COUNT(*) as count 
-            FROM SECURITY_INCIDENTS 
-            WHERE created_at >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-        """)
-        incident_count = total_incidents['COUNT'].iloc[0] if not total_incidents.empty else 0
-        st.metric("🚨 Security Incidents", format_metric(incident_count))
-        
-        with col2:
-            critical_threats = run_query(f"""
-                SELECT COUNT(*) as count 
-                FROM THREAT_INTEL_FEED 
-                WHERE severity = 'critical' 
-                AND first_seen >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-            """)
-            threat_count = critical_threats['COUNT'].iloc[0] if not critical_threats.empty else 0
-            st.metric("⚡ Critical Threats", format_metric(threat_count))
-        
-        with col3:
-            try:
-                ml_anomalies = run_query(f"""
-                    SELECT COUNT(*) as count 
-                    FROM ML_MODEL_COMPARISON 
-                    WHERE risk_level IN ('CRITICAL', 'HIGH')
-                    AND analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-                """)
-                anomaly_count = ml_anomalies['COUNT'].iloc[0] if not ml_anomalies.empty else 0
-            except:
-                # Fallback when ML_MODEL_COMPARISON doesn't exist yet
-                anomaly_count = "N/A"
-            st.metric("🎯 ML Anomalies", str(anomaly_count) if anomaly_count != "N/A" else "⚠️ Run ML Notebook")
-        
-        with col4:
-            total_users = run_query("SELECT COUNT(DISTINCT username) as count FROM EMPLOYEE_DATA")
-            user_count = total_users['COUNT'].iloc[0] if not total_users.empty else 0
-            st.metric("👥 Protected Users", format_metric(user_count))
+    if not core_counts.empty:
+        counts = dict(zip(core_counts['_Q'], core_counts['COUNT']))
+    else:
+        # Rollups not created (04 skipped or no Enterprise Edition): count the raw tables
+        incidents, threats = run_queries_parallel([
+            count_query('SECURITY_INCIDENTS', 'TRUE', 'created_at', window),
+            count_query('THREAT_INTEL_FEED', "severity = 'critical'", 'first_seen', window),
+        ])
+        counts = {'incidents': count_value(incidents), 'threats': count_value(threats)}
+    incident_count = counts.get('incidents')
+    threat_count = counts.get('threats')
+    anomaly_count = count_value(ml_anomalies)
+    try:
+        user_count = get_user_count()
+    except Exception as e:
+        st.error(f"Query execution error: {str(e)}")
+        user_count = 0
+    
+    create_metric_cards([
+        ("🚨 Security Incidents", format_metric(incident_count) if incident_count is not None else "⚠️ Unavailable"),
+        ("⚡ Critical Threats", format_metric(threat_count) if threat_count is not None else "⚠️ Unavailable"),
+        ("🎯 ML Anomalies", str(anomaly_count) if anomaly_count is not None else "⚠️ Run ML Notebook"),
+        ("👥 Protected Users", format_metric(user_count)),
+    ])
     
     # Risk trend chart
     st.subheader("📈 Security Risk Trends")
     
-    try:
-        risk_trends = run_query(f"""
+    if risk_trends.empty:
+        # Fallback: Use the pre-aggregated security incidents when the ML table
+        # doesn't exist yet. Like the incident tile, whole days come from the rollup and
+        # the partial first day from the raw table; the read is quiet since the rollup
+        # is optional too.
+        risk_trends = run_query("""
             SELECT 
-                DATE(analysis_date) as date,
-                risk_level,
+                date,
+                severity as risk_level,
+                incidents
+            FROM MV_INCIDENTS_DAILY_BY_SEVERITY
+            WHERE date > DATE(?::TIMESTAMP_LTZ)
+            UNION ALL
+            SELECT 
+                DATE(created_at) as date,
+                severity as risk_level,
                 COUNT(*) as incidents
-            FROM ML_MODEL_COMPARISON
-            WHERE analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-            GROUP BY DATE(analysis_date), risk_level
+            FROM SECURITY_INCIDENTS
+            WHERE created_at >= ?::TIMESTAMP_LTZ
+            AND created_at < DATEADD(day, 1, DATE(?::TIMESTAMP_LTZ))
+            GROUP BY DATE(created_at), severity
             ORDER BY date
-        """)
-    except:
-        # Fallback: Use security incidents when ML table doesn't exist
-        risk_trends = run_query(f"""
+        """, params=[window] * 3, quiet=True)
+    
+    if risk_trends.empty:
+        # Neither the ML table nor the rollup exists yet: aggregate the raw incidents
+        risk_trends = run_query("""
             SELECT 
                 DATE(created_at) as date,
                 severity as risk_level,
                 COUNT(*) as incidents
             FROM SECURITY_INCIDENTS
-            WHERE created_at >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
+            WHERE created_at >= ?::TIMESTAMP_LTZ
             GROUP BY DATE(created_at), severity
             ORDER BY date
-        """)
+        """, params=[window])
     
     if not risk_trends.empty:
-        fig = px.area(risk_trends, x='DATE', y='INCIDENTS', color='RISK_LEVEL',
-                     title="Daily Risk Level Distribution",
-                color_discrete_map={
-                         'CRITICAL': '#FF4B4B',
-                         'HIGH': '#FF8C00', 
-                         'MEDIUM': '#FFD700',
-                         'LOW': '#90EE90'
-                     })
-        st.plotly_chart(fig, use_container_width=True)
+        # Native Vega-Lite chart: one column per risk level, colored consistently
+        trend_wide = risk_trends.pivot_table(index='DATE', columns='RISK_LEVEL',
+                                             values='INCIDENTS', aggfunc='sum', fill_value=0)
+        st.caption("Daily Risk Level Distribution")
+        st.area_chart(trend_wide, color=[RISK_COLORS.get(level, '#A0A0A0') for level in trend_wide.columns])
     
 def show_anomaly_detection(days_back):
     """ML-powered anomaly detection analytics"""
     st.header("🔍 ML-Powered Anomaly Detection")
     st.markdown("*Advanced machine learning models identifying suspicious behavior*")
+    window = window_start(days_back)
     
-    # Model performance metrics
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        native_anomalies = run_query(f"""
-            SELECT COUNT(*) as count 
-            FROM NATIVE_ML_USER_BEHAVIOR 
-            WHERE native_anomaly = TRUE
-            AND timestamp >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-        """)
-        native_count = native_anomalies['COUNT'].iloc[0] if not native_anomalies.empty else 0
-        st.metric("🧠 Native ML Detections", native_count)
-    
-    with col2:
-        snowpark_anomalies = run_query(f"""
-            SELECT COUNT(*) as count 
-            FROM SNOWPARK_ML_USER_CLUSTERS 
-            WHERE snowpark_anomaly = TRUE
-            AND analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-        """)
-        snowpark_count = snowpark_anomalies['COUNT'].iloc[0] if not snowpark_anomalies.empty else 0
-        st.metric("⚡ Snowpark ML Detections", snowpark_count)
-    
-    with col3:
-        try:
-            agreement = run_query(f"""
-                SELECT COUNT(*) as count 
-                FROM ML_MODEL_COMPARISON 
-                WHERE model_agreement = 'BOTH_AGREE_ANOMALY'
-                AND analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-            """)
-            agreement_count = agreement['COUNT'].iloc[0] if not agreement.empty else 0
-        except:
-            agreement_count = "N/A"
-        st.metric("🎯 High Confidence", str(agreement_count) if agreement_count != "N/A" else "⚠️ Run ML Notebook")
+    # Model performance metrics; the three counts are independent, so fetch them concurrently
+    native_count, snowpark_count, agreement_count = map(count_value, run_queries_parallel([
+        count_query('NATIVE_ML_USER_BEHAVIOR', 'native_anomaly = TRUE', 'timestamp', window),
+        count_query('SNOWPARK_ML_USER_CLUSTERS', 'snowpark_anomaly = TRUE', 'analysis_date', window),
+        count_query('ML_MODEL_COMPARISON', "model_agreement = 'BOTH_AGREE_ANOMALY'", 'analysis_date', window),
+    ]))
+    create_metric_cards([
+        ("🧠 Native ML Detections", format_metric(native_count or 0)),
+        ("⚡ Snowpark ML Detections", format_metric(snowpark_count or 0)),
+        ("🎯 High Confidence", format_metric(agreement_count) if agreement_count is not None else "⚠️ Run ML Notebook"),
+    ])
     
     # Recent anomalies table
     st.subheader("🚨 Recent High-Risk Anomalies")
     
-    try:
-        recent_anomalies = run_query(f"""
+    # Display-only, so the cached Arrow table goes to st.dataframe without a pandas copy
+    recent_anomalies = run_query_arrow("""
         SELECT 
             username,
             analysis_date,
+            CASE risk_level WHEN 'CRITICAL' THEN '🔴' WHEN 'HIGH' THEN '🟠' END as risk_icon,
             risk_level,
             model_agreement,
             cluster_label,
             ROUND(snowpark_score, 3) as anomaly_score
             FROM ML_MODEL_COMPARISON
             WHERE risk_level IN ('CRITICAL', 'HIGH')
-            AND analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
+            AND analysis_date >= ?::TIMESTAMP_LTZ
             ORDER BY analysis_date DESC
             LIMIT 20
-        """)
-    except:
-        # Fallback: Show security incidents when ML table doesn't exist
-        recent_anomalies = run_query(f"""
+    """, params=[window])
+    
+    if recent_anomalies.num_rows == 0:
+        # Fallback: Show security incidents when the ML table doesn't exist yet
+        # (run_query_arrow reports errors and returns an empty table)
+        recent_anomalies = run_query_arrow("""
         SELECT 
             assigned_to as username,
             created_at as analysis_date,
+            CASE severity WHEN 'CRITICAL' THEN '🔴' WHEN 'HIGH' THEN '🟠' END as risk_icon,
             severity as risk_level,
             'Security Incident' as model_agreement,
             NULL as cluster_label,
             0.85 as anomaly_score
             FROM SECURITY_INCIDENTS
             WHERE severity IN ('CRITICAL', 'HIGH')
-            AND created_at >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
+            AND created_at >= ?::TIMESTAMP_LTZ
             ORDER BY created_at DESC
             LIMIT 20
-        """)
+    """, params=[window])
     
-    if not recent_anomalies.empty:
-        # Color code by risk level
-        def color_risk(val):
-            if val == 'CRITICAL':
-                return 'background-color: #ffebee'
-            elif val == 'HIGH':
-                return 'background-color: #fff3e0'
-            return ''
-        
-        styled_df = recent_anomalies.style.applymap(color_risk, subset=['RISK_LEVEL'])
-        st.dataframe(styled_df, use_container_width=True)
+    if recent_anomalies.num_rows:
+        # Risk is flagged by the RISK_ICON column from SQL; a plain frame renders without Styler HTML
+        st.dataframe(recent_anomalies, use_container_width=True, column_config={
+            "RISK_ICON": st.column_config.TextColumn("Risk", width="small"),
+            "ANALYSIS_DATE": st.column_config.DatetimeColumn("Analysis Date", format="YYYY-MM-DD HH:mm")
+        })
 
 def show_ml_comparison(days_back):
     """Compare different ML model performance"""
     st.header("📊 ML Model Comparison & Performance")
     st.markdown("*Comparing Native ML vs Snowpark ML detection capabilities*")
+    window = window_start(days_back)
     
-    # Model agreement analysis
-    try:
-        agreement_data = run_query(f"""
-            SELECT 
-                model_agreement,
-                COUNT(*) as count,
-                ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER(), 1) as percentage
-            FROM ML_MODEL_COMPARISON
-            WHERE analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
-            GROUP BY model_agreement
-            ORDER BY count DESC
-        """)
-    except:
-        # Fallback: Show simulated data when ML table doesn't exist
+    # Model agreement analysis, with metric labels and values formatted in SQL
+    agreement_data = run_query("""
+        SELECT 
+            model_agreement,
+            INITCAP(REPLACE(model_agreement, '_', ' ')) as label,
+            COUNT(*) as count,
+            ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER(), 1) as percentage,
+            COUNT(*) || ' (' || ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER(), 1) || '%)' as display
+        FROM ML_MODEL_COMPARISON
+        WHERE analysis_date >= ?::TIMESTAMP_LTZ
+        GROUP BY model_agreement
+        ORDER BY count DESC
+    """, params=[window])
+    
+    if agreement_data.empty:
+        # Fallback: Show placeholder data when the ML table doesn't exist yet
         agreement_data = pd.DataFrame({
             'MODEL_AGREEMENT': ['⚠️ ML Notebook Required', 'Setup Pending', 'Run Training'],
+            'LABEL': ['⚠️ ML Notebook Required', 'Setup Pending', 'Run Training'],
             'COUNT': [1, 1, 1],
-            'PERCENTAGE': [33.3, 33.3, 33.4]
+            'PERCENTAGE': [33.3, 33.3, 33.4],
+            'DISPLAY': ['1 (33.3%)', '1 (33.3%)', '1 (33.4%)']
         })
     
     if not agreement_data.empty:
@@ -513,48 +894,43 @@ def show_ml_comparison(days_back):
         
         with col1:
             # Agreement pie chart
-            fig_pie = px.pie(agreement_data, values='COUNT', names='MODEL_AGREEMENT',
-                           title="Model Agreement Distribution")
+            fig_pie = pie_figure(agreement_data, 'COUNT', 'MODEL_AGREEMENT',
+                                 title="Model Agreement Distribution")
             st.plotly_chart(fig_pie, use_container_width=True)
         
         with col2:
             # Agreement metrics
             st.subheader("🎯 Model Performance")
-            for _, row in agreement_data.iterrows():
-                st.metric(
-                    row['MODEL_AGREEMENT'].replace('_', ' ').title(),
-                    f"{row['COUNT']} ({row['PERCENTAGE']}%)"
-                )
+            for row in agreement_data.itertuples(index=False):
+                st.metric(row.LABEL, row.DISPLAY)
 
 def show_threat_intelligence(days_back):
     """Threat intelligence and correlation"""
     st.header("🚨 Threat Intelligence Dashboard")
     st.markdown("*Real-time threat correlation and prioritization*")
+    window = window_start(days_back)
     
     # Threat metrics
-    threat_data = run_query(f"""
+    threat_data = run_query("""
     SELECT 
             threat_type,
         severity,
-            COUNT(*) as threat_count,
-            AVG(confidence_score) as avg_confidence
+            COUNT(*) as threat_count
         FROM THREAT_INTEL_FEED
-        WHERE first_seen >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
+        WHERE first_seen >= ?::TIMESTAMP_LTZ
         GROUP BY threat_type, severity
         ORDER BY threat_count DESC
-    """)
+    """, params=[window])
     
     if not threat_data.empty:
         # Threat heatmap
-        fig_heatmap = px.density_heatmap(
-                threat_data,
-            x='THREAT_TYPE', 
-            y='SEVERITY', 
-            z='THREAT_COUNT',
-            title="Threat Type vs Severity Heatmap"
-        )
+        fig_heatmap = heatmap_figure(threat_data, 'THREAT_TYPE', 'SEVERITY', 'THREAT_COUNT',
+                                     title="Threat Type vs Severity Heatmap")
         st.plotly_chart(fig_heatmap, use_container_width=True)
 
+# Chat messages kept (and re-rendered) per session; older ones are dropped
+CHAT_HISTORY_LIMIT = 50
+
 def show_ai_assistant():
     """Cortex Analyst-powered security assistant"""
     st.header("🤖 Cortex Analyst Security Assistant")
@@ -583,11 +959,11 @@ def show_ai_assistant():
     
     # Initialize chat history and suggestions
     if "cortex_messages" not in st.session_state:
-        st.session_state.cortex_messages = []
+        st.session_state.cortex_messages = deque(maxlen=CHAT_HISTORY_LIMIT)
         st.session_state.active_suggestion = None
     
     # Display chat messages
-    for message_index, message in enumerate(st.session_state.cortex_messages):
+    for message in st.session_state.cortex_messages:
         with st.chat_message(message["role"]):
             if message["role"] == "assistant":
                 display_cortex_content(
@@ -606,6 +982,26 @@ def show_ai_assistant():
     if prompt := st.chat_input("Ask me about your cybersecurity data..."):
         process_cortex_message(prompt)
 
+# Shown in the chat when the Cortex Analyst REST call fails
+CORTEX_UNAVAILABLE_TEXT = """❌ **Cortex Analyst Unavailable**
+
+This could be due to:
+- Semantic model file not uploaded to stage
+- Cortex Analyst not enabled for this account
+- Network connectivity issues
+
+**To enable Cortex Analyst**:
+1. Upload `cybersecurity_semantic_model.yaml` to stage `SEMANTIC_MODEL_STAGE`
+2. Ensure Cortex Analyst is enabled for your account
+3. Verify your role has the required privileges
+
+**Try these sample insights instead**:
+- Recent authentication patterns show 85% success rate
+- 15% of logins fail due to invalid passwords
+- Engineering department has highest activity volume
+- 3 critical security incidents currently open
+"""
+
 def process_cortex_message(prompt: str) -> None:
     """Processes a message using Cortex Analyst and adds response to chat."""
     # Add user message to chat history
@@ -638,24 +1034,7 @@ def process_cortex_message(prompt: str) -> None:
                 # Fallback response
                 fallback_content = [{
                     "type": "text",
-                    "text": """❌ **Cortex Analyst Unavailable**
-                    
-This could be due to:
-- Semantic model file not uploaded to stage
-- Cortex Analyst not enabled for this account
-- Network connectivity issues
-
-**To enable Cortex Analyst**:
-1. Upload `cybersecurity_semantic_model.yaml` to stage `SEMANTIC_MODEL_STAGE`
-2. Ensure Cortex Analyst is enabled for your account
-3. Verify your role has the required privileges
-
-**Try these sample insights instead**:
-- Recent authentication patterns show 85% success rate
-- 15% of logins fail due to invalid passwords
-- Engineering department has highest activity volume
-- 3 critical security incidents currently open
-                    """
+                    "text": CORTEX_UNAVAILABLE_TEXT
                 }]
                 display_cortex_content(content=fallback_content)
                 
@@ -669,62 +1048,116 @@ def show_user_analytics(days_back):
     """User behavior analytics"""
     st.header("👥 User Behavior Analytics")
     st.markdown("*ML-powered user behavior analysis and clustering*")
+    window = window_start(days_back)
     
     # User clusters
-    cluster_data = run_query(f"""
+    cluster_data = run_query("""
     SELECT 
             cluster_label,
-            COUNT(*) as user_count,
-            AVG(countries) as avg_countries,
-            AVG(weekend_ratio) as avg_weekend_activity
+            COUNT(*) as user_count
         FROM SNOWPARK_ML_USER_CLUSTERS
-        WHERE analysis_date >= DATEADD(day, -{days_back}, CURRENT_TIMESTAMP())
+        WHERE analysis_date >= ?::TIMESTAMP_LTZ
         GROUP BY cluster_label
         ORDER BY user_count DESC
-    """)
+    """, params=[window])
     
     if not cluster_data.empty:
         # Cluster visualization
-        fig_cluster = px.bar(cluster_data, x='CLUSTER_LABEL', y='USER_COUNT',
-                           title="User Behavioral Clusters")
-        fig_cluster.update_xaxis(title="Behavior Pattern")
-        fig_cluster.update_yaxis(title="Number of Users")
-        st.plotly_chart(fig_cluster, use_container_width=True)
+        st.caption("User Behavioral Clusters")
+        st.bar_chart(cluster_data, x='CLUSTER_LABEL', y='USER_COUNT',
+                     x_label="Behavior Pattern", y_label="Number of Users")
 
+# Events kept in the live table, and the poll that tops it up with rows newer than
+# the last one seen. WINDOW_START comes back even when there are no new events so
+# rows older than the hour can be aged out client-side.
+REALTIME_EVENT_LIMIT = 50
+REALTIME_TAIL_SQL = f"""
+    WITH poll AS (
+        SELECT DATEADD(minute, -60, CURRENT_TIMESTAMP())::TIMESTAMP_NTZ as window_start
+    )
+    SELECT 
+        poll.window_start,
+        e.timestamp,
+        e.username,
+        e.source_ip,
+        e.country,
+        e.status_icon
+    FROM poll
+    LEFT JOIN (
+        SELECT 
+            timestamp,
+            username,
+            source_ip,
+            location:country::STRING as country,
+            CASE WHEN success THEN '✅' ELSE '❌' END as status_icon
+        FROM USER_AUTHENTICATION_LOGS
+        WHERE timestamp >= DATEADD(minute, -60, CURRENT_TIMESTAMP())
+        AND timestamp > ?::TIMESTAMP_NTZ
+        ORDER BY timestamp DESC
+        LIMIT {REALTIME_EVENT_LIMIT}
+    ) e ON TRUE
+    ORDER BY e.timestamp DESC
+"""
+
+@st.fragment(run_every=30)
 def show_realtime_monitoring():
     """Real-time security monitoring"""
     st.header("⚡ Real-time Security Monitoring")
     st.markdown("*Live security event stream and alerting*")
     
-    # Auto-refresh every 30 seconds
-    if st.button("🔄 Refresh Data"):
-        st.rerun()
+    # Auto-refresh every 30 seconds; the button rereads the whole hour
+    if st.button("🔄 Refresh Data") or "realtime_events" not in st.session_state:
+        st.session_state.realtime_events = pd.DataFrame()
     
-    # Recent events
-    recent_events = run_query("""
-SELECT 
-    timestamp,
-    username,
-    source_ip,
-            location:country::STRING as country,
-            success,
-            CASE WHEN success THEN '✅' ELSE '❌' END as status_icon
-FROM USER_AUTHENTICATION_LOGS
-        WHERE timestamp >= DATEADD(minute, -60, CURRENT_TIMESTAMP())
-        ORDER BY timestamp DESC
-        LIMIT 50
-    """)
+    events = st.session_state.realtime_events
+    since = str(events['TIMESTAMP'].max()) if not events.empty else '1970-01-01 00:00:00'
+    try:
+        # Not cached: each poll must see new rows, and it only reads the tail
+        poll = session.sql(REALTIME_TAIL_SQL, params=[since]).to_pandas()
+        new_events = poll.dropna(subset=['TIMESTAMP']).drop(columns='WINDOW_START')
+        if not new_events.empty:
+            events = new_events if events.empty else pd.concat([new_events, events], ignore_index=True)
+        if not events.empty:
+            events = events[events['TIMESTAMP'] >= poll['WINDOW_START'].iloc[0]].head(REALTIME_EVENT_LIMIT)
+        st.session_state.realtime_events = events
+    except Exception as e:
+        st.error(f"Query execution error: {str(e)}")
     
-    if not recent_events.empty:
+    if not events.empty:
         st.subheader("🕐 Last Hour Activity")
-        st.dataframe(recent_events, use_container_width=True)
+        st.dataframe(events, use_container_width=True, column_config={
+            "TIMESTAMP": st.column_config.DatetimeColumn("Time", format="YYYY-MM-DD HH:mm:ss")
+        })
 
-def show_cortex_analyst():
-    """Natural language analytics interface"""
-    st.header("🔍 Cortex Analyst - Natural Language Analytics")
-    st.markdown("*Ask questions in natural language about your security data*")
+# Number of past analyst interactions kept and re-rendered on each rerun
+ANALYST_HISTORY_DISPLAY = 5
+
+def ask_analyst(question: str, context: str) -> Dict[str, Any]:
+    """Answer a question, record the exchange in the session's analyst history and return it"""
+    # A per-session sequence number keys the exchange's widgets, since the same
+    # question may be asked more than once
+    st.session_state.analyst_asked = st.session_state.get("analyst_asked", 0) + 1
     
-    # Sidebar with example questions
+    # Try Cortex Analyst first, fallback to structured queries
+    try:
+        response = query_cortex_analyst(question, context)
+    except Exception as e:
+        response = {"success": False, "error": str(e)}
+    
+    if not response.get("success"):
+        response = create_fallback_response(question)
+    
+    interaction = {
+        "question": question,
+        "response": response,
+        "context": context,
+        "key": f"analyst_{st.session_state.analyst_asked}"
+    }
+    st.session_state.analyst_history.append(interaction)
+    return interaction
+
+def show_analyst_examples():
+    """Sidebar with example questions for the Cortex Analyst section"""
     with st.sidebar:
         st.markdown("---")
         st.subheader("💡 Example Questions")
@@ -749,6 +1182,14 @@ def show_cortex_analyst():
         - "What's the model agreement rate?"
         - "Which users have high risk scores?"
         """)
+
+# A fragment, so asking a question or changing the context doesn't rerun the whole app;
+# it can't write to the sidebar, hence show_analyst_examples()
+@st.fragment
+def show_cortex_analyst():
+    """Natural language analytics interface"""
+    st.header("🔍 Cortex Analyst - Natural Language Analytics")
+    st.markdown("*Ask questions in natural language about your security data*")
     
     # Context selector
     context = st.selectbox(
@@ -760,11 +1201,14 @@ def show_cortex_analyst():
     # Main query interface
     st.subheader("🤖 Natural Language Query")
     
+    if st.button("🗑️ Clear cache", help="Discard cached analyst responses"):
+        query_cortex_analyst.clear()
+    
     # Chat-style interface
     if "analyst_history" not in st.session_state:
-        st.session_state.analyst_history = []
+        st.session_state.analyst_history = deque(maxlen=ANALYST_HISTORY_DISPLAY)
     
-    # Display previous interactions
+    # Display the most recent interactions straight from session state
     for interaction in st.session_state.analyst_history:
         with st.container():
             st.markdown(f"**🧑 Question:** {interaction['question']}")
@@ -772,7 +1216,7 @@ def show_cortex_analyst():
             if interaction['response']['success']:
                 st.markdown(f"**🤖 Analysis:** {interaction['response']['explanation']}")
                 
-                if interaction['response']['data']:
+                if not interaction['response']['data'].empty:
                     # Show data visualization
                     chart_type = interaction['response'].get('chart_type', 'bar')
                     visualize_data(interaction['response']['data'], chart_type)
@@ -783,7 +1227,10 @@ def show_cortex_analyst():
                         
                     # Show raw data
                     with st.expander("📊 View Raw Data"):
-                        st.dataframe(pd.DataFrame(interaction['response']['data']))
+                        st.dataframe(interaction['response']['data'], use_container_width=True)
+                
+                if interaction['response'].get('truncated') and interaction['response']['sql']:
+                    offer_full_download(interaction['response']['sql'].strip().rstrip(';'), interaction['key'])
             else:
                 st.error(f"Error: {interaction['response']['error']}")
             
@@ -797,25 +1244,20 @@ def show_cortex_analyst():
     
     if st.button("🔍 Analyze", type="primary") and question:
         with st.spinner("Analyzing your security data..."):
-            # Try Cortex Analyst first, fallback to structured queries
-            response = query_cortex_analyst(question, context)
-            
-            if not response.get("success"):
-                response = create_fallback_response(question)
-            
-            # Add to history
-            st.session_state.analyst_history.append({
-                "question": question,
-                "response": response,
-                "context": context
-            })
+            interaction = ask_analyst(question, context)
+            response = interaction['response']
             
             # Display current response
             if response.get("success"):
                 st.success("✅ Analysis complete!")
                 st.markdown(f"**🤖 Insight:** {response['explanation']}")
                 
-                if response.get('data'):
+                if response.get('truncated'):
+                    st.warning(f"Showing the first {MAX_RESULT_ROWS:,} rows of a larger result.")
+                    if response['sql']:
+                        offer_full_download(response['sql'].strip().rstrip(';'), interaction['key'])
+                
+                if not response['data'].empty:
                     chart_type = response.get('chart_type', 'bar')
                     visualize_data(response['data'], chart_type)
                     
@@ -825,33 +1267,44 @@ def show_cortex_analyst():
                 st.error(f"❌ {response.get('error', 'Unknown error occurred')}")
     
     # Quick action buttons
+    show_quick_actions()
+
+# Quick analysis buttons: label -> (fallback intent, chart type)
+QUICK_ACTIONS = {
+    "🚨 Recent Incidents": ("incidents", "bar"),
+    "👥 User Patterns": ("users", "pie"),
+    "🎯 Threat Overview": ("threats", "heatmap"),
+}
+
+def select_quick_action(label: str) -> None:
+    """Button callback remembering which quick analysis to show"""
+    st.session_state.quick_action = label
+
+@st.fragment
+def show_quick_actions():
+    """Quick analysis buttons, rerun on their own without re-executing the page"""
     st.subheader("⚡ Quick Analysis")
     
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        if st.button("🚨 Recent Incidents"):
-            response = create_fallback_response("show me recent security incidents")
-            if response.get("success") and response.get('data'):
-                visualize_data(response['data'], 'bar')
+    columns = st.columns(len(QUICK_ACTIONS))
+    for col, label in zip(columns, QUICK_ACTIONS):
+        with col:
+            st.button(label, on_click=select_quick_action, args=(label,))
     
-    with col2:
-        if st.button("👥 User Patterns"):
-            response = create_fallback_response("analyze user behavior patterns")
-            if response.get("success") and response.get('data'):
-                visualize_data(response['data'], 'pie')
-    
-    with col3:
-        if st.button("🎯 Threat Overview"):
-            response = create_fallback_response("show me current threat landscape")
-            if response.get("success") and response.get('data'):
-                visualize_data(response['data'], 'heatmap')
+    # Query only once a button has been clicked; repeat clicks are run_query cache hits
+    label = st.session_state.get("quick_action")
+    if label:
+        intent, chart_type = QUICK_ACTIONS[label]
+        response = fallback_response(intent, run_query(*fallback_query(intent)))
+        if not response['data'].empty:
+            visualize_data(response['data'], chart_type)
 
 # =====================================================
 # MAIN APPLICATION
 # =====================================================
 
 def main():
+    configure_session()
+    
     # Header
     st.title("🛡️ Snowflake Cybersecurity Analytics Demo")
     st.markdown("**Real-time security analytics powered by Snowflake Native ML and AI**")
@@ -878,7 +1331,19 @@ def main():
     if demo_section != "🔍 Cortex Analyst":
         st.sidebar.markdown("---")
         st.sidebar.subheader("📅 Analysis Period")
-        days_back = st.sidebar.slider("Days to analyze", 1, 90, 7)
+        # Slider changes inside a form don't rerun the app; sections requery only on Apply
+        with st.sidebar.form("analysis_period"):
+            # Seeded from the applied value, since the slider's state is dropped on pages without it
+            days_slider = st.slider("Days to analyze", 1, 90,
+                                    value=st.session_state.get("days_back_applied", 7), key="days_slider")
+            if st.form_submit_button("Apply"):
+                st.session_state.days_back_applied = days_slider
+    days_back = st.session_state.get("days_back_applied", 7)
+    
+    st.sidebar.markdown("---")
+    if st.sidebar.button("🔄 Clear Cached Results", help="Re-run every query against Snowflake"):
+        _run_query_arrow.clear()
+        get_user_count.clear()
     
     # Route to appropriate section
     if demo_section == "🏢 Executive Dashboard":
@@ -896,6 +1361,7 @@ def main():
     elif demo_section == "⚡ Real-time Monitoring":
         show_realtime_monitoring()
     elif demo_section == "🔍 Cortex Analyst":
+        show_analyst_examples()
         show_cortex_analyst()
 
 # Run the main application
@@ -0,0 +1,58 @@
+-- ===============================================
+-- Cybersecurity Demo - Dashboard Aggregates
+-- ===============================================
+-- This script creates pre-aggregated objects read by the Streamlit app so
+-- dashboard charts scan a handful of summary rows instead of raw event tables
+-- Prerequisites: Run 01_cybersecurity_schema.sql through 03_native_ml_and_cortex.sql first
+-- Note: Materialized views require Snowflake Enterprise Edition or higher
+-- Optional: without these objects the app reads the raw tables on its default warehouse
+
+USE DATABASE CYBERSECURITY_DEMO;
+USE SCHEMA SECURITY_ANALYTICS;
+USE WAREHOUSE CYBERSECURITY_WH;
+
+-- ===============================================
+-- Streamlit App Warehouse
+-- ===============================================
+
+-- Small dedicated warehouse for interactive dashboard reads, kept separate from
+-- the ML training workload on CYBERSECURITY_WH
+CREATE WAREHOUSE IF NOT EXISTS CYBERSECURITY_APP_WH 
+WITH WAREHOUSE_SIZE = 'XSMALL' 
+AUTO_SUSPEND = 60 
+AUTO_RESUME = TRUE;
+
+-- ===============================================
+-- Executive Dashboard - Daily Rollups
+-- ===============================================
+
+-- Daily incident counts by severity (Security Incidents tile and Security Risk Trends fallback chart)
+-- Snowflake maintains this incrementally as new incidents are inserted
+CREATE OR REPLACE MATERIALIZED VIEW MV_INCIDENTS_DAILY_BY_SEVERITY AS
+SELECT 
+    DATE(CREATED_AT) as DATE,
+    SEVERITY,
+    COUNT(*) as INCIDENTS
+FROM SECURITY_INCIDENTS
+GROUP BY DATE(CREATED_AT), SEVERITY;
+
+-- Daily threat indicator counts by severity (Critical Threats tile)
+CREATE OR REPLACE MATERIALIZED VIEW MV_THREATS_DAILY_BY_SEVERITY AS
+SELECT 
+    DATE(FIRST_SEEN) as DATE,
+    SEVERITY,
+    COUNT(*) as THREATS
+FROM THREAT_INTEL_FEED
+GROUP BY DATE(FIRST_SEEN), SEVERITY;
+
+-- Note: ML_MODEL_COMPARISON becomes a multi-table view once the Snowpark ML
+-- notebook has run, so its risk trend cannot be backed by a materialized view
+
+-- ===============================================
+-- Verification
+-- ===============================================
+
+SHOW MATERIALIZED VIEWS;
+SHOW WAREHOUSES LIKE 'CYBERSECURITY_APP_WH';
+
+SELECT 'Dashboard aggregates created successfully!' as STATUS;